@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+import numpy as np
+import cv2 as cv
+
+# glyphs are 28 by 28 light-on-dark images as returned by `framechar`
+GLYPH_SIZE = 28
+
+# the OpenCV python bindings accept at most this many channels per image
+MAX_CHANNELS = 128
+
+# OpenCV remaps images at most SHRT_MAX pixels wide, this many glyphs
+MAX_MOSAIC = 1024
+
+# default augmentation settings
+# scaled down from the page-level settings in notebooks/images to the
+# size of a single glyph, expressed in pixels unless stated otherwise
+DISPLACEMENT = 1.5          # max displacement along either axis
+DISPLACEMENT_GRID = 4       # control points per axis of a displacement field
+STROKE_PROBS = (0.2, 0.6, 0.2)  # probabilities to thin, keep or thicken strokes
+THINNING = 0.4              # max opacity of the eroded glyph over the original
+BLUR_SIGMA = 1.0            # gaussian blur sigma at full blur opacity
+CONTRAST = (0.55, 1.0)      # range of ink brightness after augmentation
+GAMMA = (0.7, 1.4)          # range of the curves exponent
+NOISE = 20                  # max std of the noise in uint8 units
+NOISE_SIGMA = 0.6           # gaussian sigma used to smooth the noise
+
+
+def apply_stacked(batch, func):
+    """Apply an OpenCV filter to every glyph in a batch
+
+    Receive a batch of images as a 3D numpy array of shape (N, H, W) and
+    a function taking and returning a single multi-channel image. Stack
+    the batch along the channel axis in chunks of at most `MAX_CHANNELS`
+    and filter each chunk in a single call. Return a new 3D numpy array
+    of shape (N, H', W') where H' and W' are determined by `func`.
+    """
+
+    chunks = []
+    for start in range(0, len(batch), MAX_CHANNELS):
+        chunk = np.ascontiguousarray(batch[start:start + MAX_CHANNELS].transpose(1, 2, 0))
+        filtered = func(chunk)
+
+        # OpenCV drops the channel axis of single-channel images
+        filtered = filtered.reshape(*filtered.shape[:2], -1)
+        chunks.append(filtered.transpose(2, 0, 1))
+
+    return np.concatenate(chunks)
+
+
+def displace(batch, rng, amplitude=DISPLACEMENT, grid=DISPLACEMENT_GRID):
+    """Warp each glyph by its own random smooth displacement field
+
+    Receive a batch of glyphs as a 3D float32 numpy array. Draw a coarse
+    `grid` by `grid` field of displacements uniformly from the range
+    [-`amplitude`, `amplitude`] for each glyph and axis and upscale it to
+    glyph size. Resample every glyph at the displaced coordinates using
+    bilinear interpolation, treating the area outside the glyph as
+    background. Return a new array in original format.
+    """
+
+    count, height, width = batch.shape
+
+    # coarse fields for both axes of all glyphs, upscaled in one go
+    field = rng.uniform(-amplitude, amplitude, (2 * count, grid, grid)).astype(np.float32)
+    field = apply_stacked(field, lambda x: cv.resize(x, (width, height), interpolation=cv.INTER_CUBIC))
+    dy, dx = field[:count], field[count:]
+
+    # pad each glyph with a 1 px background border so that clipped
+    # coords sample the background, not the neighbouring glyph
+    padded = np.pad(batch, ((0, 0), (1, 1), (1, 1)))
+
+    # absolute sampling coords within each padded glyph
+    map_y = np.clip(np.arange(1, height + 1, dtype=np.float32)[:, None] + dy, 0, height + 1)
+    map_x = np.clip(np.arange(1, width + 1, dtype=np.float32) + dx, 0, width + 1)
+
+    # lay the glyphs side by side in a single row and remap it at once
+    # offsetting the x coords of each glyph by its position in the row
+    map_x += np.arange(count, dtype=np.float32)[:, None, None] * (width + 2)
+
+    warped = []
+    for start in range(0, count, MAX_MOSAIC):
+        stop = start + MAX_MOSAIC
+        mosaic = np.hstack(padded[start:stop])
+        chunk_x = np.hstack(map_x[start:stop]) - start * (width + 2)
+        chunk_y = np.hstack(map_y[start:stop])
+        chunk = cv.remap(mosaic, chunk_x, chunk_y, cv.INTER_LINEAR)
+        warped.append(chunk.reshape(height, -1, width).transpose(1, 0, 2))
+
+    return np.concatenate(warped)
+
+
+def restroke(batch, rng, probs=STROKE_PROBS, thinning=THINNING):
+    """Randomly thin or thicken the strokes of each glyph
+
+    Receive a batch of glyphs as a 3D float32 numpy array. Erode, keep
+    or dilate each glyph with probabilities given by `probs`. Since the
+    ink is light, eroding thins and dilating thickens the strokes. Blend
+    the result with the original at a random opacity per glyph, up to
+    `thinning` for eroded glyphs. Return a new array in original format.
+
+    Note: The strokes of `framechar` output are about 2 px wide, so even
+    the smallest erosion wipes out most of the ink and some glyphs
+    entirely. Blending it in only partially keeps every glyph legible.
+    """
+
+    kernel = cv.getStructuringElement(cv.MORPH_CROSS, (3, 3))
+    thinned = apply_stacked(batch, lambda x: cv.erode(x, kernel))
+    thickened = apply_stacked(batch, lambda x: cv.dilate(x, kernel))
+
+    choice = rng.choice(3, size=len(batch), p=probs)
+    restroked = np.choose(choice[:, None, None], (thinned, batch, thickened))
+
+    max_opacity = np.where(choice == 0, thinning, 1).astype(np.float32)
+    opacity = rng.uniform(0, 1, len(batch)).astype(np.float32) * max_opacity
+
+    return batch + (restroked - batch) * opacity[:, None, None]
+
+
+def blur(batch, rng, sigma=BLUR_SIGMA):
+    """Blur each glyph by a random amount
+
+    Receive a batch of glyphs as a 3D float32 numpy array. Blur the whole
+    batch once with a gaussian of the given `sigma` and blend it with the
+    original at a random opacity per glyph, which approximates a range of
+    blur strengths at the cost of a single filter pass. Return a new
+    array in original format.
+    """
+
+    blurred = apply_stacked(batch, lambda x: cv.GaussianBlur(x, (0, 0), sigma))
+    opacity = rng.uniform(0, 1, (len(batch), 1, 1)).astype(np.float32)
+
+    return batch + (blurred - batch) * opacity
+
+
+def recurve(batch, rng, contrast=CONTRAST, gamma=GAMMA):
+    """Randomly adjust the curves and contrast of each glyph
+
+    Receive a batch of glyphs as a 3D float32 numpy array of values in
+    range [0, 255]. Apply a random gamma from the `gamma` range and scale
+    the ink brightness by a random factor from the `contrast` range,
+    keeping the background black. Return a new array in original format.
+    """
+
+    shape = (len(batch), 1, 1)
+    gammas = rng.uniform(*gamma, shape).astype(np.float32)
+    gains = rng.uniform(*contrast, shape).astype(np.float32)
+
+    return np.power(batch / 255, gammas) * (255 * gains)
+
+
+def add_noise(batch, rng, noise=NOISE, sigma=NOISE_SIGMA):
+    """Add smooth random noise to each glyph
+
+    Receive a batch of glyphs as a 3D float32 numpy array. Add gaussian
+    noise smoothed by a gaussian blur of the given `sigma`, resembling
+    the simplex noise used for the dataset. Its strength is drawn per
+    glyph from the range [0, `noise`]. Return a new array in original
+    format.
+    """
+
+    grain = rng.standard_normal(batch.shape, dtype=np.float32)
+    grain = apply_stacked(grain, lambda x: cv.GaussianBlur(x, (0, 0), sigma))
+
+    # smoothing reduces the std of the noise, restore it
+    grain /= grain.std()
+    strength = rng.uniform(0, noise, (len(batch), 1, 1)).astype(np.float32)
+
+    return batch + grain * strength
+
+
+def augment(batch, rng=None):
+    """Augment a batch of glyphs
+
+    Receive a batch of glyphs as a uint8 numpy array of shape (N, 28, 28)
+    or (N, 28, 28, 1) as required by the CNN classifier. Apply random
+    displacement, stroke width, blur, curves, contrast and noise to each
+    glyph independently. Return a new uint8 numpy array in original shape.
+    """
+
+    if rng is None:
+        rng = np.random.default_rng()
+
+    shape = batch.shape
+    out = batch.reshape(-1, GLYPH_SIZE, GLYPH_SIZE).astype(np.float32)
+
+    out = displace(out, rng)
+    out = restroke(out, rng)
+    out = blur(out, rng)
+    out = recurve(out, rng)
+    out = add_noise(out, rng)
+
+    return np.clip(np.round(out), 0, 255).astype(np.uint8).reshape(shape)
+
+
+def augment_stream(X, y, batch_size=512, rng=None):
+    """Generate an endless stream of augmented training batches
+
+    Receive glyphs `X` in any format accepted by `augment` and their
+    labels `y`. Sample `batch_size` glyphs at random, augment them and
+    yield them along with their labels as a tuple of numpy arrays.
+    Nothing is stored, so every batch is newly augmented.
+    """
+
+    if rng is None:
+        rng = np.random.default_rng()
+
+    X = np.asarray(X)
+    y = np.asarray(y)
+
+    while True:
+        indices = rng.integers(0, len(X), batch_size)
+        yield augment(X[indices], rng), y[indices]
+
+
+def run_benchmark(batch_size=512, batches=50):
+    """Measure augmentation throughput on a single core
+
+    Generate a batch of synthetic glyphs and time `augment` over a number
+    of batches with OpenCV restricted to a single thread. Print the
+    throughput in glyphs per second per core, to be compared against the
+    number of glyphs per second consumed by a CNN training step.
+    """
+
+    cv.setNumThreads(1)
+    rng = np.random.default_rng(0)
+
+    # crude light-on-dark strokes in place of the dataset glyphs
+    glyphs = np.zeros((batch_size, GLYPH_SIZE, GLYPH_SIZE), dtype=np.uint8)
+    for glyph in glyphs:
+        for _ in range(2):
+            pt1, pt2 = (tuple(int(v) for v in rng.integers(4, 24, 2)) for _ in range(2))
+            cv.line(glyph, pt1, pt2, 255, 2)
+
+    # warm up
+    augment(glyphs, rng)
+
+    start = time.perf_counter()
+    for _ in range(batches):
+        augment(glyphs, rng)
+    elapsed = time.perf_counter() - start
+
+    print(f'batch size: {batch_size}, batches: {batches}')
+    print(f'{batch_size * batches / elapsed:,.0f} glyphs per second per core')
+
+
+if __name__ == '__main__':
+    run_benchmark()
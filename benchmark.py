@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import sys
+import time
+import argparse
+import resource
+import subprocess
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+import cv2 as cv
+import extractor
+import photomathex
+import launcher
+
+
+def time_usage_message():
+    """Measure the time `photomathex.py` takes to print its usage message
+
+    Run it without arguments in a new process, which should not import
+    tensorflow at all. Return the wall time in seconds until it exits.
+    """
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, 'photomathex.py'], stdout=subprocess.DEVNULL)
+
+    return time.perf_counter() - start
+
+
+def cold_start(img_name):
+    """Measure a cold start of `photomathex.py` on a single image
+
+    Run it in a new process that has to import all modules and load the
+    classifier before solving the image. Return the time in seconds to
+    the first result and the peak RSS of the process in kB.
+
+    Note: Peak RSS is taken over all child processes waited for so far,
+    so `main` runs this before starting any other child process.
+    """
+
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'photomathex.py', img_name],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+
+    # a single image name, so no "from" header is printed
+    process.stdout.readline()
+    elapsed = time.perf_counter() - start
+
+    process.communicate()
+    peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    return elapsed, peak_rss
+
+
+def warm_start(img_name, workers=1):
+    """Measure a warm start of the launcher on a single image
+
+    Start the launcher and wait until it has loaded the classifier. Then
+    request the image and time the first result. Raise RuntimeError if
+    the launcher exits before it is ready. Return the time in
+    seconds to the first result and the memory usage reported by the
+    worker as a string.
+    """
+
+    process = subprocess.Popen([sys.executable, 'launcher.py', '--stats', '--workers', str(workers)],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, text=True)
+
+    # skip whatever tensorflow reports while loading
+    row = ''
+    for row in process.stderr:
+        if row.strip() == launcher.READY:
+            break
+    else:
+        process.wait()
+        raise RuntimeError(f'launcher exited before it was ready: {row.strip()}')
+
+    start = time.perf_counter()
+    process.stdin.write(f'{img_name}\n')
+    process.stdin.flush()
+
+    # skip the empty line and the "from" header
+    for row in process.stdout:
+        if row.startswith('from '):
+            break
+    process.stdout.readline()
+    elapsed = time.perf_counter() - start
+
+    memory = 'n/a'
+    for row in process.stderr:
+        if row.startswith('worker memory'):
+            memory = row.split(':', 1)[1].strip()
+            break
+
+    # closes stdin, which ends the launcher
+    process.communicate()
+
+    return elapsed, memory
+
+
+def line_parallelism(img_name, thread_counts, repeats=3):
+    """Measure single-image latency against the number of threads
+
+    Solve the image in this process with lines and thresholding strips
+    processed by thread pools of the given sizes. A single thread means
+    no thread pool, as in `photomathex.py` by default, and is always
+    measured first as the reference. Return a list of tuples of the
+    thread count, the best latency in seconds of extracting the lines
+    alone and of solving the whole image.
+    """
+
+    img = cv.imread(img_name, 1)
+    classifier = photomathex.load_classifier()
+
+    def best_time(func, *args):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    # warm up
+    photomathex.solve_image(img, classifier)
+
+    latencies = []
+    for count in sorted({1, *thread_counts}):
+        with ThreadPoolExecutor(count) if count > 1 else nullcontext() as executor:
+            latencies.append((count,
+                              best_time(extractor.extract_lines, img, executor),
+                              best_time(photomathex.solve_image, img, classifier, executor)))
+
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure time to first result, memory usage and single-image latency.')
+    parser.add_argument('img_name', metavar='image')
+    parser.add_argument('-t', '--threads', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='thread counts to measure single-image latency with (default: 1 2 4 8)')
+    args = parser.parse_args()
+
+    # the first child process, see `cold_start`
+    elapsed, peak_rss = cold_start(args.img_name)
+    print(f'cold start: time to first result {elapsed:.3f} s, peak RSS {peak_rss / 1024:.1f} MiB')
+
+    print(f'usage message: {time_usage_message():.3f} s')
+
+    elapsed, memory = warm_start(args.img_name)
+    print(f'warm start: time to first result {elapsed:.3f} s, worker {memory}')
+
+    latencies = line_parallelism(args.img_name, args.threads)
+    # speedup relative to a single thread
+    _, base_lines, base_image = latencies[0]
+    for count, lines, image in latencies:
+        print(f'{count} threads: extracting lines {lines:.3f} s ({base_lines / lines:.2f}x), '
+              f'solving image {image:.3f} s ({base_image / image:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
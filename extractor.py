@@ -20,6 +20,9 @@ MIN_LINE_HEIGHT = 50    # lowest allowable height for the whole line
 # expressed in units of sigma over the histogram of uint8 values
 WHITE_SPREAD = 3
 
+# number of horizontal strips to threshold concurrently
+THRESH_STRIPS = 16
+
 
 def desaturate(img):
     """Desaturate an RGB or BGR image
@@ -80,25 +83,76 @@ def autothresh(img):
      TBD: Accommodate for uneven lighting and/or shadows.
     """
 
-    # autostretch it
-    img_out = autostretch(img).astype(float)
+    # threshold via a lookup table built from the histogram, which
+    # spares a float copy of the whole image and sorting it for median
+    hist = np.bincount(img.ravel(), minlength=256)
+
+    return threshold_lut(hist).take(img)
+
+
+# helper function for `autothresh` and `autothresh_strips`
+def threshold_lut(hist):
+    """Build a thresholding lookup table from a histogram
+
+    Receive a histogram of a single-channel uint8 image as a 1D numpy
+    array of 256 pixel counts. Autostretch and threshold all 256 values
+    instead of every pixel, deriving the median and std of the stretched
+    image from the histogram. Return a lookup table mapping each value
+    to 0 or 255 as a 1D uint8 numpy array.
+    """
+
+    count = hist.sum()
+
+    # autostretch it, values outside of the image's range do not occur
+    values = np.flatnonzero(hist)
+    black, white = values[0], values[-1]
+    stretched = np.zeros(256)
+    stretched[black:white + 1] = autostretch(np.arange(black, white + 1, dtype=np.uint8))
+    stretched[white + 1:] = 255
 
     # median is a good approximation of the middle "background" value
     # mode was also tested but the difference was negligible
-    median = np.median(img_out)
+    cumsum = np.cumsum(hist)
+    middle = np.searchsorted(cumsum, [(count - 1) // 2, count // 2], side='right')
+    median = stretched[middle].mean()
 
     # std is an indication of unevenness of lighting over the paper
     # ink values are basically outliers
-    std = img_out.std()
+    mean = (hist * stretched).sum() / count
+    std = np.sqrt((hist * (stretched - mean) ** 2).sum() / count)
 
     # instead of the classic IQR outlier detection, a custom one:
     thresh = max(median - WHITE_SPREAD * std, median / 2)
 
-    # apply the threshold
-    img_out[img_out > thresh] = 255
-    img_out[img_out <= thresh] = 0
+    return np.where(stretched > thresh, 255, 0).astype(np.uint8)
 
-    return img_out.astype(np.uint8)
+
+def autothresh_strips(img, executor=None, strips=THRESH_STRIPS):
+    """Desaturate and threshold an image in horizontal strips
+
+    Receive an RGB or BGR image as a 3D uint8 numpy array and, optionally,
+    an executor from `concurrent.futures`. Split the image into `strips`
+    horizontal strips and desaturate them, concurrently if an executor
+    is provided. Derive the thresholding lookup table from the merged
+    histograms of the strips, then threshold the strips. Return a list of
+    thresholded strips as 2D uint8 numpy arrays which, stacked
+    vertically, equal `autothresh(desaturate(img))`.
+
+    Note: Concurrency is only worth it for large images, relies on numpy
+    releasing the GIL.
+    """
+
+    map_ = map if executor is None else executor.map
+    bounds = np.linspace(0, img.shape[0], strips + 1).astype(int)
+
+    def desaturate_strip(start, stop):
+        strip = desaturate(img[start:stop])
+        return strip, np.bincount(strip.ravel(), minlength=256)
+
+    gray_strips, hists = zip(*map_(desaturate_strip, bounds[:-1], bounds[1:]))
+    lut = threshold_lut(np.sum(hists, axis=0))
+
+    return list(map_(lut.take, gray_strips))
 
 
 def get_mask(img, axis=None):
@@ -182,12 +236,15 @@ def sort_masks(masks, ascending=False):
     return sorted_masks
 
 
-def extract_lines(img):
+def extract_lines(img, executor=None):
     """Line extractor
 
     Receive an RGB or BGR image as a 3D uint8 numpy array. Return
     top/bottom-cropped blocks of content as a list of single-channel
     black and white images in a 2D uint8 numpy array format.
+
+    Optionally, if an executor from `concurrent.futures` is provided,
+    threshold the image in concurrent strips (see `autothresh_strips`).
     """
 
     if not isinstance(img, np.ndarray):
@@ -197,13 +254,15 @@ def extract_lines(img):
     elif img.shape[0] < MIN_IMG_HEIGHT or img.shape[1] < MIN_IMG_WIDTH:
         raise ValueError(f'minimum image dimensions are {MIN_IMG_WIDTH} by {MIN_IMG_HEIGHT}')
 
-    img = desaturate(img)
-    # cv.imwrite('desaturate.jpg', img)
-    img = autothresh(img)
+    # the whole image in a single strip unless processed concurrently
+    map_ = map if executor is None else executor.map
+    strips = autothresh_strips(img, executor, THRESH_STRIPS if executor is not None else 1)
+
+    # extract roi from image strip by strip
+    vmask = np.concatenate(list(map_(lambda strip: get_mask(strip, axis=1), strips)))
+    img = np.vstack(strips)
     # cv.imwrite('autothresh.jpg', img)
 
-    # extract roi from image
-    vmask = get_mask(img, axis=1)
     linemasks = split_mask(vmask, minsize=MIN_LINE_HEIGHT)
     if not len(linemasks):
         raise Exception(f'unable to detect a line of content at least {MIN_LINE_HEIGHT} pixels high')
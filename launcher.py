@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+import cv2 as cv
+import photomathex
+
+# printed to stderr once the workers have loaded the classifier
+READY = 'launcher ready'
+
+# imported once by the fork server and inherited by every worker,
+# none of them imports tensorflow until the classifier is loaded
+PRELOAD = ['numpy', 'cv2', 'extractor', 'solver', 'photomathex']
+
+
+def memory_usage():
+    """Report memory usage of the current process
+
+    Read the resident set size (RSS) and the proportional set size (PSS)
+    from /proc. PSS splits the pages shared with other processes, such as
+    the ones inherited from the fork server, evenly among them. Return a
+    dict of values in kB, empty if not available (i.e. on non-Linux OS).
+    """
+
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup') as file:
+            for row in file:
+                key, value = row.split(':', 1)
+                if key in ('Rss', 'Pss'):
+                    usage[key] = int(value.split()[0])
+    except (OSError, ValueError):
+        pass
+
+    return usage
+
+
+def start_worker(started, failures):
+    """Worker initializer
+
+    Import tensorflow and load the classifier in the worker, once for
+    its whole lifetime, then release the `started` semaphore. If loading
+    fails, put the error message into the `failures` queue before
+    releasing the semaphore and re-raise the error.
+
+    Note: Tensorflow is not fork-safe once its runtime has started, so
+    neither the launcher nor the fork server ever load the classifier.
+    """
+
+    try:
+        photomathex.load_classifier()
+    except Exception as e:
+        failures.put(str(e))
+        raise
+    finally:
+        started.release()
+
+
+def solve_page(job):
+    """Worker function
+
+    Receive a tuple of the index of the page within its request, the
+    name of the shared memory block holding the page and the shape of
+    the page. Classify and solve the page in place, without copying it.
+    Return a tuple of the index, a list of results as returned by
+    `photomathex.solve_image` and the memory usage of the worker.
+    """
+
+    index, name, shape = job
+    if name is None:
+        return index, ['Error reading image file'], memory_usage()
+
+    page = shared_memory.SharedMemory(name=name)
+    try:
+        img = np.ndarray(shape, dtype=np.uint8, buffer=page.buf)
+        try:
+            results = photomathex.solve_image(img, photomathex.load_classifier())
+        except Exception as e:
+            results = [str(e)]
+
+        # release the view before closing the shared memory
+        del img
+    finally:
+        page.close()
+
+    return index, results, memory_usage()
+
+
+def serve(pool, img_names):
+    """Solve pages in the already started workers
+
+    Receive a pool of workers started with `start_worker` and a list of
+    names of existing image files. Read each page into a shared memory
+    block the workers can access without copying it, only as the pool
+    asks for the next job. Yield a tuple of the image name, its list of
+    results and the memory usage of the worker that solved it, for each
+    page in order.
+    """
+
+    pages = []
+
+    def jobs():
+        for index, img_name in enumerate(img_names):
+            img = cv.imread(img_name, 1)
+            if img is None:
+                yield index, None, None
+                continue
+
+            page = shared_memory.SharedMemory(create=True, size=img.nbytes)
+            pages.append(page)
+            np.ndarray(img.shape, dtype=np.uint8, buffer=page.buf)[:] = img
+            yield index, page.name, img.shape
+
+    try:
+        # the pool reads the jobs in its own thread, the first page is
+        # solved while the rest are still being read
+        for index, results, usage in pool.imap(solve_page, jobs()):
+            yield img_names[index], results, usage
+
+    finally:
+        for page in pages:
+            page.close()
+            page.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Solve expressions from images using workers with a preloaded classifier. '
+                    'Without image filenames on the command line, read them from stdin, '
+                    'one request per line.')
+    parser.add_argument('img_names', nargs='*', metavar='image')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default: CPU count)')
+    parser.add_argument('-s', '--stats', action='store_true',
+                        help='report time to first result and per-worker memory to stderr')
+    args = parser.parse_args()
+
+    if args.img_names:
+        requests = [args.img_names]
+    else:
+        requests = (row.split() for row in sys.stdin)
+
+    ctx = mp.get_context('forkserver')
+    ctx.set_forkserver_preload(PRELOAD)
+
+    # wait for every worker to load the classifier, exit if any fails
+    # instead of letting the pool restart failing workers forever
+    started = ctx.Semaphore(0)
+    failures = ctx.SimpleQueue()
+    with ctx.Pool(args.workers, initializer=start_worker, initargs=(started, failures)) as pool:
+        for _ in range(args.workers):
+            started.acquire()
+            if not failures.empty():
+                sys.exit(f'Could not load the classifier: {failures.get()}')
+        print(READY, file=sys.stderr, flush=True)
+
+        for img_names in requests:
+            if not img_names:
+                continue
+
+            valid_img_names = photomathex.check_img_names(img_names)
+            if not valid_img_names:
+                print("No existing file name was specified.", flush=True)
+                continue
+
+            start = time.perf_counter()
+            for count, (img_name, results, usage) in enumerate(serve(pool, valid_img_names)):
+                if not count and args.stats:
+                    print(f'time to first result: {time.perf_counter() - start:.3f} s', file=sys.stderr)
+
+                for result in results:
+                    print(f'\nfrom {img_name}:', flush=True)
+                    print(result, flush=True)
+
+                if args.stats:
+                    memory = ', '.join(f'{key} {value / 1024:.1f} MiB' for key, value in usage.items())
+                    print(f'worker memory for {img_name}: {memory or "n/a"}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
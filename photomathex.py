@@ -3,11 +3,13 @@
 
 import os
 import sys
+import argparse
+from contextlib import nullcontext
 from itertools import compress
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import cv2 as cv
 import extractor
-from tensorflow.keras import models
 import solver
 
 
@@ -15,6 +17,10 @@ import solver
 LABELS = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '0',
           '+', '-', '*', '/', '(', ')']
 
+# trained CNN, loaded on first use by `load_classifier`
+MODEL_FILENAME = 'pm_model_md.h5'
+_classifier = None
+
 
 # simple preprocessing
 def framechar(char, reshape=False):
@@ -56,22 +62,35 @@ def framechar(char, reshape=False):
     return new_canvas
 
 
-def main():
-    if len(sys.argv) == 1:
-        print('Provide valid image filenames as command line arguments.')
-        return
+def load_classifier():
+    """Load the trained CNN classifier on first use
 
-    # fetch image file names from command line arguments
-    img_names = sys.argv[1:]
+    Import tensorflow and load the model from `MODEL_FILENAME` only when
+    first called, since importing tensorflow alone takes seconds. Return
+    the same model on every subsequent call.
+    """
+
+    global _classifier
 
-    # determine which files exist, exit if none
+    if _classifier is None:
+        from tensorflow.keras import models
+        _classifier = models.load_model(MODEL_FILENAME)
+
+    return _classifier
+
+
+def check_img_names(img_names):
+    """Report non-existing image files
+
+    Receive a list of image file names. Print the names of files that
+    do not exist, if any, unless none of the files exist. Return a list
+    of the names of existing files.
+    """
+
+    # determine which files exist, report nothing if none
     valid_img_names_indices = list(map(os.path.exists, img_names))
     if not any(valid_img_names_indices):
-        print("No existing file name was specified.")
-        return
-
-    # extract the names of existing files
-    valid_img_names = list(compress(img_names, valid_img_names_indices))
+        return []
 
     # extract the names of non-existing files and report them
     invalid_img_names_indices = [not item for item in valid_img_names_indices]
@@ -79,55 +98,129 @@ def main():
         invalid_img_names = list(compress(img_names, invalid_img_names_indices))
         print('Could not found:', *invalid_img_names)
 
-    # load a trained CNN
-    my_cls = models.load_model('pm_model_md.h5')
+    return list(compress(img_names, valid_img_names_indices))
+
+
+def solve_line(line, classifier):
+    """Classify and solve a single line of an image
+
+    Receive a single image from a list returned by
+    `extractor.extract_lines` and a trained CNN classifier. Decode the
+    most probable valid expression from the classifier output. Return
+    the text to be reported for the line: the expression and its result
+    if a valid one was found, followed by the most probable characters
+    and the probability of the expression if they differ. Otherwise
+    return the most probable characters followed by a note that they do
+    not form a valid expression.
+    """
+
+    # extract token candidates
+    chars = extractor.extract_chars(line)
+
+    # classify all extracted candidates at once, keep the full softmax
+    # output to fall back on less probable labels
+    # calling the model directly (unlike `predict`) is safe from threads
+    chars = np.stack([framechar(char) for char in chars]).reshape(-1, 28, 28, 1)
+    probabilities = np.asarray(classifier(chars.astype(np.float32), training=False))
+
+    # the most probable label of each candidate, valid or not
+    predicted = [LABELS[np.argmax(pred)] for pred in probabilities]
+    expression_candidate = ' '.join(predicted)
+
+    # find the most probable valid expression
+    decoded = solver.decode(probabilities, LABELS)
+    if decoded is None:
+        return f'{expression_candidate}\nnot a valid expression'
+
+    # `decode` only checks validity, the expression still needs to be
+    # reformatted by `validate` as required by `evaluate`
+    expression, probability = decoded
+    validated_expression = solver.validate(expression)
+
+    # do not print the outermost parentheses
+    result = solver.evaluate(validated_expression)
+    report = f'{validated_expression[2: -2]} = {result}'
+
+    # flag the expression if less probable labels were substituted
+    if expression != expression_candidate:
+        report += f'\ncorrected from: {expression_candidate} (probability {probability:.3g})'
 
-    for img_name in valid_img_names:
-        if not os.path.exists(img_name):
-            print(f'cannot find image: {img_name}')
-            continue
+    return report
 
+
+def solve_image(img, classifier, executor=None):
+    """Classify and solve all lines of an image
+
+    Receive an RGB or BGR image as a 3D uint8 numpy array and a trained
+    CNN classifier. Return a list with the text reported by `solve_line`
+    for each line in the image, in order. Errors in processing a single
+    line are reported in its place.
+
+    Optionally, if an executor from `concurrent.futures` is provided,
+    threshold the image in strips and solve the lines concurrently.
+    """
+
+    def solve(line):
         try:
-            img = cv.imread(img_name, 1)
+            return solve_line(line, classifier)
         except Exception as e:
-            print(f'Error reading image file: {img_name}')
-            print(e)
-            continue
+            return str(e)
 
-        # extract line candidates
-        lines = extractor.extract_lines(img)
+    # extract line candidates
+    lines = extractor.extract_lines(img, executor)
 
-        for line in lines:
-            try:
-                # extract token candidates
-                chars = extractor.extract_chars(line)
+    if executor is None:
+        return [solve(line) for line in lines]
 
-                # classify extracted candidates
-                predicted = []
-                for char in chars:
-                    char = framechar(char, reshape=True)
-                    pred = my_cls.predict(char)
-                    label = LABELS[np.argmax(pred)]
-                    predicted.append(label)
+    # results are returned in line order
+    return list(executor.map(solve, lines))
 
-                # generate expression string and check if it is valid
-                expression_candidate = ' '.join(predicted)
-                validated_expression = solver.validate(expression_candidate)
 
-                # print the current filename if more was specified
-                if len(img_names) > 1:
-                    print(f'\nfrom {img_name}:')
+def main():
+    if len(sys.argv) == 1:
+        print('Provide valid image filenames as command line arguments.')
+        return
+
+    parser = argparse.ArgumentParser(description='Solve expressions from images.')
+    parser.add_argument('img_names', nargs='+', metavar='image')
+    parser.add_argument('-t', '--threads', type=int, default=1,
+                        help='number of threads to process the lines of each image with (default: 1)')
+    args = parser.parse_args()
 
-                if validated_expression is not None:
-                    # do not print the outermost parentheses
-                    print(f'{validated_expression[2: -2]} = ', end='')
-                    result = solver.evaluate(validated_expression)
-                    print(result)
-                else:
-                    print(f'{expression_candidate}\nnot a valid expression')
+    # fetch image file names from command line arguments
+    img_names = args.img_names
+
+    # extract the names of existing files, exit if none
+    valid_img_names = check_img_names(img_names)
+    if not valid_img_names:
+        print("No existing file name was specified.")
+        return
+
+    # load a trained CNN
+    my_cls = load_classifier()
+
+    # the executor is None unless more than one thread was requested
+    threads = ThreadPoolExecutor(args.threads) if args.threads > 1 else nullcontext()
 
+    with threads as executor:
+        for img_name in valid_img_names:
+            if not os.path.exists(img_name):
+                print(f'cannot find image: {img_name}')
+                continue
+
+            try:
+                img = cv.imread(img_name, 1)
             except Exception as e:
+                print(f'Error reading image file: {img_name}')
                 print(e)
+                continue
+
+            for result in solve_image(img, my_cls, executor):
+                # print the current filename if more was specified
+                if len(img_names) > 1:
+                    print(f'\nfrom {img_name}:')
+
+                print(result)
 
 
 if __name__ == '__main__':
@@ -2,6 +2,8 @@
 # coding: utf-8
 
 import re
+import math
+import heapq
 import operator
 
 operators = {
@@ -22,6 +24,26 @@ op_precedences = [
     r'(-?\s*\d+(?:\.\d+)?)\s*([+-])\s*(-?\s*\d+(?:\.\d+)?)',
 ]
 
+# token kinds as seen by the incremental validator
+token_kinds = {
+    **dict.fromkeys('0123456789', 'digit'),
+    '.': 'dot',
+    '-': 'minus',
+    '+': 'operator',
+    '*': 'operator',
+    '/': 'operator',
+    '(': 'open',
+    ')': 'close',
+}
+
+# state of the incremental validator before the first token:
+# (kind of the last token, parentheses depth, inside a decimal fraction)
+INITIAL_STATE = ('start', 0, False)
+
+# defaults for `decode`
+BEAM_WIDTH = 16     # number of most probable valid prefixes kept
+TOP_K = 3           # number of most probable labels tried per character
+
 
 def validate(expression):
     """Expression validator and reformatter
@@ -114,6 +136,139 @@ def check_parentheses(expression):
     return True
 
 
+def advance(state, token):
+    """Incremental expression validator
+
+    Receive the state of the validator as returned by the previous call
+    (or `INITIAL_STATE`) and the next single-character token. Apply the
+    rules of `validate` and `check_parentheses` as far as they concern
+    the new token. Return the new state if the expression is still
+    valid so far, otherwise return None.
+
+    Note: The rules are slightly stricter than those of `validate`, e.g.
+    an operand right after a closing parenthesis is rejected. Every
+    expression accepted here should also be accepted by `validate`.
+    """
+
+    last, depth, fraction = state
+    kind = token_kinds.get(token)
+
+    if kind == 'digit':
+        if last == 'close':
+            return None
+        # continue the current number or start a new one
+        return ('digit', depth, fraction and last in ('digit', 'dot'))
+
+    if kind == 'dot':
+        # a single decimal point per number, between digits
+        if last != 'digit' or fraction:
+            return None
+        return ('dot', depth, True)
+
+    if kind == 'minus':
+        # negation sign at the very start or right after "("
+        if last in ('start', 'open'):
+            return ('sign', depth, False)
+        if last in ('digit', 'close'):
+            return ('operator', depth, False)
+        return None
+
+    if kind == 'operator':
+        if last not in ('digit', 'close'):
+            return None
+        return ('operator', depth, False)
+
+    if kind == 'open':
+        if last not in ('start', 'open', 'sign', 'operator'):
+            return None
+        return ('open', depth + 1, False)
+
+    if kind == 'close':
+        # no more closed than opened parentheses, nothing empty in between
+        if last not in ('digit', 'close') or not depth:
+            return None
+        return ('close', depth - 1, False)
+
+    # not a valid character
+    return None
+
+
+# helper function for `decode`
+def accepts(state):
+    """Check if the incremental validator state ends a valid expression
+
+    Receive a state as returned by `advance`. Return True if the tokens
+    fed so far form a complete expression, otherwise return False.
+    """
+
+    last, depth, _ = state
+
+    return last in ('digit', 'close') and not depth
+
+
+def decode(probabilities, labels, beam_width=BEAM_WIDTH, top_k=TOP_K):
+    """Decode the most probable valid expression
+
+    Receive a sequence of probability vectors, one per character, as
+    returned by the softmax layer of the classifier, and a list of
+    labels corresponding to the vector entries. Beam search through the
+    `top_k` most probable labels of each character, keeping only the
+    `beam_width` most probable prefixes that pass `advance`. Return a
+    tuple of the most probable valid expression as a string of
+    space-separated characters and its probability. If no valid
+    expression was found, return None.
+    """
+
+    # each candidate: (log probability, validator state, token chain)
+    # where the token chain is a (token, preceding chain) tuple
+    beam = [(0.0, INITIAL_STATE, None)]
+    count = len(probabilities)
+
+    for position, probs in enumerate(probabilities):
+        probs = [float(prob) for prob in probs]
+        indices = sorted(range(len(probs)), key=probs.__getitem__, reverse=True)[:top_k]
+
+        # the number of characters left to close parentheses with
+        remaining = count - position - 1
+
+        extended = []
+        for score, state, chain in beam:
+            for index in indices:
+                if probs[index] <= 0:
+                    continue
+
+                new_state = advance(state, labels[index])
+                if new_state is None or new_state[1] > remaining:
+                    continue
+
+                # the last character must complete the expression
+                if not remaining and not accepts(new_state):
+                    continue
+
+                candidate = (score + math.log(probs[index]), new_state, (labels[index], chain))
+                extended.append(candidate)
+
+        beam = heapq.nlargest(beam_width, extended, key=lambda x: x[0])
+        if not beam:
+            return None
+
+    for score, state, chain in beam:
+        if not accepts(state):
+            continue
+
+        # unwind the token chain
+        tokens = []
+        while chain is not None:
+            token, chain = chain
+            tokens.append(token)
+        expression = ' '.join(reversed(tokens))
+
+        if validate(expression) is not None:
+            return expression, math.exp(score)
+
+    return None
+
+
 def evaluate(expression, noparentheses=False):
     """Evaluator functionality of the solver module
 
@@ -350,6 +505,42 @@ def run_tests():
             print(f'{passfail[validated is value]} -> invalid expression: {expression}')
             assert validated is value
 
+    # the incremental validator must agree with `validate`
+    for expression in {**tests, **tests_condensed}:
+        state = INITIAL_STATE
+        for token in expression.replace(' ', ''):
+            state = advance(state, token)
+            if state is None:
+                break
+        accepted = state is not None and accepts(state)
+        valid = validate(expression) is not None
+        print(f'{passfail[accepted == valid]} -> incremental validation: {expression}')
+        assert accepted == valid
+
+    # a misread glyph is recovered from the second most probable label
+    labels = ['1', '2', '3', '+', '(', ')']
+    probabilities = [
+        [0.0, 0.1, 0.9, 0.0, 0.0, 0.0],     # 3
+        [0.0, 0.0, 0.0, 0.8, 0.2, 0.0],     # +
+        [0.0, 0.3, 0.0, 0.6, 0.1, 0.0],     # + misread, 2 intended
+    ]
+    decoded = decode(probabilities, labels)
+    print(f'{passfail[decoded is not None and decoded[0] == "3 + 2"]} -> decoding: {decoded}')
+    assert decoded[0] == '3 + 2'
+    assert math.isclose(decoded[1], 0.9 * 0.8 * 0.3)
+
+    # candidates that cannot complete the expression are not kept for
+    # the last character, so they do not push out the valid ones
+    misread_last = [[0.4, 0.35, 0.25, 0.0, 0.0, 0.0]] * 5 + [[0.1, 0.0, 0.0, 0.9, 0.0, 0.0]]
+    decoded = decode(misread_last, labels)
+    print(f'{passfail[decoded is not None and decoded[0] == "1 1 1 1 1 1"]} -> decoding: {decoded}')
+    assert decoded[0] == '1 1 1 1 1 1'
+
+    # no valid expression among the candidates
+    decoded = decode(probabilities[1:], labels, top_k=1)
+    print(f'{passfail[decoded is None]} -> decoding: {decoded}')
+    assert decoded is None
+
 
 if __name__ == '__main__':
     run_tests()